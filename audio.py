@@ -1,9 +1,14 @@
 from pygame import mixer
 
+from iobus import IOBus
+
 
 class Audio:
     """A simple audio module for playing the prerecorded sounds for Space Invaders"""
-    def __init__(self) -> None:
+    def __init__(self, enabled: bool = True) -> None:
+        self.audio_enabled = False
+        if(not enabled): # Headless runs aren't throttled, the sounds would play many times too fast
+            return
         try:
             self.sound_ufo = mixer.Sound("samples/0.wav")
             self.sound_shot = mixer.Sound("samples/1.wav")
@@ -22,6 +27,10 @@ class Audio:
             print("Error while loading sound samples, please refer to the readme for more information. Audio disabled.")
             self.audio_enabled = False
 
+    def Attach(self, bus: IOBus) -> None:
+        bus.MapWrite(3, self.PlaySound3)
+        bus.MapWrite(5, self.PlaySound5)
+
     def PlaySound3(self, id: int) -> None:
         """Play sounds used by port 3"""
         if(self.audio_enabled and self.last_played_3 != id):
@@ -1,7 +1,7 @@
 from ctypes import *
 from sys import exit
 
-from audio import Audio
+from iobus import IOBus
 from memory import Memory
 
 # Most instruction run in a specific amount of cycles which can be turned into a LUT
@@ -64,29 +64,23 @@ class Registers(Structure):
         _fields_ = [("HL", c_uint16), ("HL8_8", HL_8_8)]
 
 
-    class Shift(Union):
-        class Shift_8_8(BigEndianStructure):
-            _fields_ = [("shift_lo", c_uint8, 8), ("shift_hi", c_uint8, 8)]
-
-        _anonymous_ = ("Shift8_8",)
-        _fields_ = [("shift_full", c_uint16), ("Shift8_8", Shift_8_8)]
-
-
-    _anonymous_ = ("status", "BC16", "DE16", "HL16", "shift",)
+    _anonymous_ = ("status", "BC16", "DE16", "HL16",)
     _fields_ = [("A", c_uint8), ("status", StatusReg), ("BC16", BC_16), ("DE16", DE_16), ("HL16", HL_16), ("sp", c_uint16),
-                ("pc", c_uint16), ("shift", Shift), ("shift_off", c_uint8), ("input1", c_uint8), ("input2", c_uint8)]
+                ("pc", c_uint16)]
 
 
 class CPU:
     """The main part of the emulator, an Intel 8080 interpreter"""
-    def __init__(self, mem: Memory, audio: Audio) -> None:
+    def __init__(self, mem: Memory, bus: IOBus) -> None:
         self.regs = Registers()
         self.regs.flags.unus1 = True
         self.regs.flags.unus3 = False
         self.regs.flags.unus5 = False
 
         self.mem = mem.mem
-        self.audio = audio
+        # The port tables are bound directly so IN/OUT are a single lookup
+        self.io_read = bus.read_table
+        self.io_write = bus.write_table
         self.interrupts_enabled = False
 
         self.jump_table = (self.Instr_NOP, self.Instr_LXI, self.Instr_STAX, self.Instr_INX, self.Instr_INR, self.Instr_DCR, self.Instr_MVI, self.Instr_RLC,
@@ -180,6 +174,15 @@ class CPU:
 
         return cycles[0]
 
+    def SaveState(self) -> tuple:
+        """Captures the registers and the interrupt flag"""
+        return (bytes(self.regs), self.interrupts_enabled)
+
+    def LoadState(self, state: tuple) -> None:
+        """Restores a state from SaveState, the register struct is overwritten in place"""
+        regs, self.interrupts_enabled = state
+        memmove(addressof(self.regs), regs, sizeof(Registers))
+
     def GenerateInterrupt(self, interrupt_num: int) -> None:
         """Injects an interrupt that was generated during rendering"""
         self.mem[self.regs.sp - 1] = self.regs.pc >> 8
@@ -500,26 +503,15 @@ class CPU:
         keep_pc[0] = True
 
     def Instr_OUT(self, instr, imm0, imm1, keep_pc, cycles):
-        port = imm0
-        if(port == 2):
-            self.regs.shift_off = self.regs.A & 0x7
-        elif(port == 3):
-            self.audio.PlaySound3(self.regs.A)
-        elif(port == 4):
-            self.regs.shift_lo = self.regs.shift_hi
-            self.regs.shift_hi = self.regs.A
-        elif(port == 5):
-            self.audio.PlaySound5(self.regs.A)
+        writer = self.io_write[imm0]
+        if(writer is not None):
+            writer(self.regs.A)
         self.regs.pc += 1
 
     def Instr_IN(self, instr, imm0, imm1, keep_pc, cycles):
-        port = imm0
-        if(port == 1):
-            self.regs.A = self.regs.input1
-        elif(port == 2):
-                self.regs.A = self.regs.input2
-        elif(port == 3):
-                self.regs.A = (self.regs.shift_full >> (8 - self.regs.shift_off)) & 0xff
+        reader = self.io_read[imm0]
+        if(reader is not None):
+            self.regs.A = reader()
         self.regs.pc += 1
 
     def Instr_XTHL(self, instr, imm0, imm1, keep_pc, cycles):
@@ -1,8 +1,12 @@
+from time import perf_counter
+
 import pygame
 
 from audio import Audio
 from cpu import CPU
+from iobus import InputPorts, IOBus, ShiftRegister, Watchdog
 from memory import Memory
+from metrics import Metrics
 
 CLOCKSPEED = 2000000
 REFRESH_RATE = 60
@@ -10,45 +14,120 @@ CYCLES_PER_FRAME = CLOCKSPEED // REFRESH_RATE
 CYCLES_PER_HALF_FRAME = CYCLES_PER_FRAME // 2
 
 
+def DrawVRAM(vram: bytes, scaled: pygame.Surface) -> None:
+    """Converts a 1-bit VRAM snapshot into the upright, scaled picture"""
+    surface = pygame.Surface((256, 224))
+    pixelarray = pygame.PixelArray(surface)
+    for i, vram_byte in enumerate(vram):
+        for j in range(8):
+            if((vram_byte >> j) & 1):
+                pixelarray[((i*8) + j) % 256, (i*8) // 256] = 0xffffff # White
+
+    pygame.transform.scale(pygame.transform.rotate(surface, 90.0), (672, 768), scaled)
+
+
 class Emulator:
     """The foundation that ties together the other modules"""
-    def __init__(self, rom_path: str, debug: bool) -> None:
+    def __init__(self, rom_path: str, debug: bool, headless: bool = False, sinks: tuple = (),
+                 metrics_path: str | None = None, metrics_port: int | None = None, metrics_interval: float = 5.0,
+                 overlay: bool = False) -> None:
         pygame.init()
-        pygame.event.set_blocked(None)
-        pygame.event.set_allowed((pygame.KEYDOWN, pygame.KEYUP, pygame.QUIT))
+        self.headless = headless
+        if(not headless):
+            pygame.event.set_blocked(None)
+            pygame.event.set_allowed((pygame.KEYDOWN, pygame.KEYUP, pygame.QUIT))
 
-        pygame.display.set_icon(pygame.image.load("icon.bmp"))
-        pygame.display.set_caption("Space Invaders")
-        self.scaled = pygame.display.set_mode((672, 768))
+            pygame.display.set_icon(pygame.image.load("icon.bmp"))
+            pygame.display.set_caption("Space Invaders")
+            self.scaled = pygame.display.set_mode((672, 768))
+            self.font = pygame.font.Font(None, 24)
+
+        self.audio = Audio(not headless)
+        self.inputs = InputPorts()
+        self.shifter = ShiftRegister()
+        self.watchdog = Watchdog()
+
+        self.bus = IOBus()
+        for device in (self.inputs, self.shifter, self.audio, self.watchdog):
+            device.Attach(self.bus)
 
-        self.audio = Audio()
         self.memory = Memory(rom_path, debug)
         self.mem = self.memory.mem
-        self.cpu = CPU(self.memory, self.audio)
+        self.cpu = CPU(self.memory, self.bus)
 
         # Most of the debug ROMs are loaded at address 0x100
         if(debug):
             self.cpu.regs.pc = 0x100
 
+        # Frame consumers like the recorder or the spectator server, they are given each finished frame
+        self.sinks = sinks
+        # Set by netplay, it decides which frames run and with whose inputs
+        self.netplay = None
+        self.metrics = Metrics(CLOCKSPEED, REFRESH_RATE, metrics_path, metrics_port, metrics_interval)
+        self.overlay = overlay
         self.running = True
 
-    def Run(self) -> None:
-        """Runs the main loop of the emulation"""
+    def Run(self, max_frames: int | None = None) -> None:
+        """Runs the main loop of the emulation, headless runs aren't throttled to the refresh rate unless someone watches live"""
         clock = pygame.time.Clock()
-        while(self.running):
-            clock.tick(REFRESH_RATE)
-            self.HandleEvents()
-            self.RunFrame()
-            self.DrawFrame()
-
-    def RunFrame(self) -> None:
-        """Runs the emulation for one complete frame"""
+        throttled = not self.headless or self.netplay is not None or any(sink.realtime for sink in self.sinks)
+        frame = 0
+        try:
+            while(self.running and frame != max_frames):
+                if(throttled):
+                    clock.tick(REFRESH_RATE)
+                start = perf_counter()
+                if(not self.headless):
+                    self.HandleEvents()
+                events_done = perf_counter()
+                if(self.netplay is not None):
+                    self.netplay.Advance()
+                else:
+                    self.RunFrame()
+                cpu_done = perf_counter()
+                # Handing the frame to the sinks counts as rendering, both produce the frame's output
+                for sink in self.sinks:
+                    sink.Submit(self.mem)
+                if(not self.headless):
+                    self.DrawFrame()
+                render_done = perf_counter()
+                if(not self.headless):
+                    pygame.display.flip()
+                flip_done = perf_counter()
+
+                self.metrics.EndFrame({"events": events_done - start, "cpu": cpu_done - events_done,
+                                       "render": render_done - cpu_done, "flip": flip_done - render_done})
+                frame += 1
+        finally: # Headless runs are usually stopped with Ctrl+C, the recording should still be complete
+            self.Close()
+
+    def Close(self) -> None:
+        """Closes the sinks, netplay and metrics, each one even if closing an earlier one failed"""
+        closers = [sink.Close for sink in self.sinks]
+        if(self.netplay is not None):
+            closers.append(self.netplay.Close)
+        closers.append(self.metrics.Close)
+
+        error = None
+        for close in closers:
+            try:
+                close()
+            except Exception as e:
+                error = error or e
+        if(error is not None):
+            raise error
+
+    def RunFrame(self, resimulated: bool = False, counted: bool = True) -> None:
+        """Runs the emulation for one complete frame, resimulated is set by netplay when it runs a frame again.
+        Frames that are only run to be timed and then thrown away aren't counted."""
         first_interrupt = True
         cycle_tot = cycle_var = 0
+        instructions = second_interrupts = 0
         while(cycle_tot <= CYCLES_PER_FRAME):
             cycles = self.cpu.Step()
             cycle_tot += cycles
             cycle_var += cycles
+            instructions += 1
 
             if(cycle_var >= CYCLES_PER_HALF_FRAME - 19 and self.cpu.interrupts_enabled):
                 if(first_interrupt):
@@ -57,18 +136,31 @@ class Emulator:
                     cycle_var = 0
                 else:
                     self.cpu.GenerateInterrupt(2)
+                    second_interrupts += 1
+
+        # Reported once per frame, so the metrics cost nothing per instruction beyond the counter above
+        delivered = (not first_interrupt) + second_interrupts
+        missed = first_interrupt + (second_interrupts == 0)
+        if(counted):
+            self.metrics.CountFrame(cycle_tot, instructions, delivered, missed, resimulated)
+
+    def SaveState(self) -> tuple:
+        """Captures everything a frame depends on except the inputs, which are set before every frame anyway"""
+        return (bytes(self.mem), self.cpu.SaveState(), self.shifter.SaveState())
+
+    def LoadState(self, state: tuple) -> None:
+        """Restores a state from SaveState"""
+        mem, cpu, shifter = state
+        self.mem[:] = mem # In place, the CPU holds a reference to the same bytearray
+        self.cpu.LoadState(cpu)
+        self.shifter.LoadState(shifter)
 
     def DrawFrame(self) -> None:
         """Load the data contained in the VRAM into the surface that the user sees"""
-        surface = pygame.Surface((256, 224))
-        pixelarray = pygame.PixelArray(surface)
-        for i, vram_byte in enumerate(self.mem[0x2400: 0x4000]):
-            for j in range(8):
-                if((vram_byte >> j) & 1):
-                    pixelarray[((i*8) + j) % 256, (i*8) // 256] = 0xffffff # White
-
-        pygame.transform.scale(pygame.transform.rotate(surface, 90.0), (672, 768), self.scaled)
-        pygame.display.flip()
+        DrawVRAM(self.mem[0x2400: 0x4000], self.scaled)
+        if(self.overlay):
+            for i, line in enumerate(self.metrics.OverlayLines()):
+                self.scaled.blit(self.font.render(line, True, (0, 255, 0)), (4, 4 + i * 20))
 
     def HandleEvents(self) -> None:
         """Handles keyboard presses and the quit event"""
@@ -86,41 +178,43 @@ class Emulator:
                                                   5: 1500 points
                       numbers 6-7 - coin info 6: off
                                               7: on
+                      F1          - performance overlay
             """
             match event.type:
                 case pygame.KEYDOWN: # A.W.D for player 1, left.up.right for player 2
                     key = pygame.key.name(event.key)
-                    if(key == "a"): self.cpu.regs.input1 |= 0b00100000
-                    elif(key == "d"): self.cpu.regs.input1 |= 0b01000000
-                    elif(key == "w"): self.cpu.regs.input1 |= 0b00010000
-                    elif(key == "e"): self.cpu.regs.input1 |= 0b00000100
-                    elif(key == "left"): self.cpu.regs.input2 |= 0b00100000
-                    elif(key == "right"): self.cpu.regs.input2 |= 0b01000000
-                    elif(key == "up"): self.cpu.regs.input2 |= 0b00010000
-                    elif(key == "right ctrl"): self.cpu.regs.input1 |= 0b00000010
-                    elif(key == "space"): self.cpu.regs.input2 |= 0b00000100
+                    if(key == "a"): self.inputs.input1 |= 0b00100000
+                    elif(key == "d"): self.inputs.input1 |= 0b01000000
+                    elif(key == "w"): self.inputs.input1 |= 0b00010000
+                    elif(key == "e"): self.inputs.input1 |= 0b00000100
+                    elif(key == "left"): self.inputs.input2 |= 0b00100000
+                    elif(key == "right"): self.inputs.input2 |= 0b01000000
+                    elif(key == "up"): self.inputs.input2 |= 0b00010000
+                    elif(key == "right ctrl"): self.inputs.input1 |= 0b00000010
+                    elif(key == "space"): self.inputs.input2 |= 0b00000100
                     # Dipswitches(they don't need a keyup event) and exit:
-                    elif(key == "return"): self.cpu.regs.input1 &= 0b11111110
-                    elif(key == "`"): self.cpu.regs.input2 &= 0b11111100
-                    elif(key == "1"): self.cpu.regs.input2 &= 0b11111100; self.cpu.regs.input2 += 1
-                    elif(key == "2"): self.cpu.regs.input2 &= 0b11111100; self.cpu.regs.input2 += 2
-                    elif(key == "3"): self.cpu.regs.input2 &= 0b11111100; self.cpu.regs.input2 += 3
-                    elif(key == "4"): self.cpu.regs.input2 |= 0b00001000
-                    elif(key == "5"): self.cpu.regs.input2 &= 0b11110111
-                    elif(key == "6"): self.cpu.regs.input2 |= 0b10000000
-                    elif(key == "7"): self.cpu.regs.input2 &= 0b01111111
+                    elif(key == "return"): self.inputs.input1 &= 0b11111110
+                    elif(key == "`"): self.inputs.input2 &= 0b11111100
+                    elif(key == "1"): self.inputs.input2 &= 0b11111100; self.inputs.input2 += 1
+                    elif(key == "2"): self.inputs.input2 &= 0b11111100; self.inputs.input2 += 2
+                    elif(key == "3"): self.inputs.input2 &= 0b11111100; self.inputs.input2 += 3
+                    elif(key == "4"): self.inputs.input2 |= 0b00001000
+                    elif(key == "5"): self.inputs.input2 &= 0b11110111
+                    elif(key == "6"): self.inputs.input2 |= 0b10000000
+                    elif(key == "7"): self.inputs.input2 &= 0b01111111
+                    elif(key == "f1"): self.overlay = not self.overlay
                     elif(key == "escape"): self.running = False
                 case pygame.KEYUP:
                     key = pygame.key.name(event.key)
-                    if(key == "a"): self.cpu.regs.input1 &= 0b11011111
-                    elif(key == "d"): self.cpu.regs.input1 &= 0b10111111
-                    elif(key == "w"): self.cpu.regs.input1 &= 0b11101111
-                    elif(key == "e"): self.cpu.regs.input1 &= 0b11111011
-                    elif(key == "left"): self.cpu.regs.input2 &= 0b11011111
-                    elif(key == "right"): self.cpu.regs.input2 &= 0b10111111
-                    elif(key == "up"): self.cpu.regs.input2 &= 0b11101111
-                    elif(key == "right ctrl"): self.cpu.regs.input1 &= 0b11111101
-                    elif(key == "space"): self.cpu.regs.input2 &= 0b11111011
-                    elif(key == "return"): self.cpu.regs.input1 |= 0b1
+                    if(key == "a"): self.inputs.input1 &= 0b11011111
+                    elif(key == "d"): self.inputs.input1 &= 0b10111111
+                    elif(key == "w"): self.inputs.input1 &= 0b11101111
+                    elif(key == "e"): self.inputs.input1 &= 0b11111011
+                    elif(key == "left"): self.inputs.input2 &= 0b11011111
+                    elif(key == "right"): self.inputs.input2 &= 0b10111111
+                    elif(key == "up"): self.inputs.input2 &= 0b11101111
+                    elif(key == "right ctrl"): self.inputs.input1 &= 0b11111101
+                    elif(key == "space"): self.inputs.input2 &= 0b11111011
+                    elif(key == "return"): self.inputs.input1 |= 0b1
                 case pygame.QUIT:
                     self.running = False
@@ -0,0 +1,177 @@
+import os
+import queue
+import struct
+import threading
+import zlib
+from argparse import ArgumentParser
+
+VRAM_START = 0x2400
+VRAM_END = 0x4000
+VRAM_SIZE = VRAM_END - VRAM_START
+WIDTH = 256
+HEIGHT = 224
+
+MAGIC = b"SIFS"
+VERSION = 1
+HEADER = struct.Struct("<4sBHH") # magic, version, width, height
+RECORD = struct.Struct("<BI")    # record type, payload length
+
+KEYFRAME = 0
+DELTA = 1
+KEYFRAME_INTERVAL = 60 # Once a second, so a reader can resync quickly
+
+
+def XorFrames(a: bytes, b: bytes) -> bytes:
+    """XORs two VRAM snapshots, doing it on big integers is much faster than byte by byte"""
+    return (int.from_bytes(a, "little") ^ int.from_bytes(b, "little")).to_bytes(VRAM_SIZE, "little")
+
+
+def EncodeKeyframe(vram: bytes) -> bytes:
+    """Encodes a self-contained frame record"""
+    payload = zlib.compress(vram)
+    return RECORD.pack(KEYFRAME, len(payload)) + payload
+
+
+def EncodeDelta(prev: bytes, vram: bytes) -> bytes:
+    """Encodes a frame record relative to the previous frame"""
+    # Consecutive frames mostly match, so the XOR is long runs of zeroes that deflate squeezes down to a few bytes
+    payload = zlib.compress(XorFrames(prev, vram))
+    return RECORD.pack(DELTA, len(payload)) + payload
+
+
+def DecodeRecord(kind: int, payload: bytes, prev: bytes | None) -> bytes:
+    """Turns a record back into a full VRAM snapshot"""
+    data = zlib.decompress(payload)
+    if(kind == KEYFRAME):
+        return data
+    elif(kind == DELTA):
+        if(prev is None):
+            raise ValueError("Delta frame without a preceding keyframe")
+        return XorFrames(prev, data)
+    raise ValueError(f"Unknown record type {kind}")
+
+
+class FrameRecorder:
+    """Writes every frame's VRAM to a stream file, the encoding and file I/O run on a background thread"""
+    realtime = False
+
+    def __init__(self, path: str, queue_size: int = 120) -> None:
+        self.file = open(path, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION, WIDTH, HEIGHT))
+
+        # Bounded, so a slow disk throttles the emulator instead of eating all the memory. No frame is ever dropped.
+        self.queue = queue.Queue(queue_size)
+        self.error = None
+        self.thread = threading.Thread(target=self.Worker, name="FrameRecorder", daemon=True)
+        self.thread.start()
+
+    def Submit(self, mem: bytearray) -> None:
+        """Queues the current frame, slicing the bytearray is the only work done on the emulator's thread"""
+        self.Put(mem[VRAM_START: VRAM_END])
+
+    def Close(self) -> None:
+        """Flushes the remaining frames and closes the file"""
+        try:
+            self.Put(None)
+            self.thread.join()
+        finally:
+            self.file.close()
+        if(self.error is not None):
+            raise self.error
+
+    def Put(self, item: bytearray | None) -> None:
+        """Waits for room in the queue, but gives up with the writer's error if the writer thread died"""
+        while(True):
+            if(self.error is not None):
+                raise self.error
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def Worker(self) -> None:
+        prev = None
+        since_key = 0
+        try:
+            while((vram := self.queue.get()) is not None):
+                if(prev is None or since_key >= KEYFRAME_INTERVAL):
+                    self.file.write(EncodeKeyframe(vram))
+                    since_key = 0
+                else:
+                    self.file.write(EncodeDelta(prev, vram))
+                since_key += 1
+                prev = vram
+        except Exception as error: # A full disk for example, the emulator's thread raises it on its next call
+            self.error = error
+
+
+def ReadFrames(path: str):
+    """Yields the VRAM snapshot of every frame in a stream file"""
+    with open(path, "rb") as f:
+        magic, version, width, height = HEADER.unpack(f.read(HEADER.size))
+        if(magic != MAGIC or version != VERSION or (width, height) != (WIDTH, HEIGHT)):
+            raise ValueError(f"{path} is not a supported frame stream")
+
+        prev = None
+        while(len(record := f.read(RECORD.size)) == RECORD.size):
+            kind, length = RECORD.unpack(record)
+            prev = DecodeRecord(kind, f.read(length), prev)
+            yield prev
+
+
+def ToRows(vram: bytes) -> list:
+    """Converts a VRAM snapshot into rows of 0/1 pixels, rotated upright like the cabinet's monitor"""
+    # Each VRAM byte holds 8 horizontal pixels of the 256x224 framebuffer, LSB first.
+    # The monitor is rotated 90 degrees counterclockwise, so framebuffer column x becomes row 255 - x.
+    rows = []
+    for x in range(WIDTH - 1, -1, -1):
+        column = vram[x >> 3: VRAM_SIZE: WIDTH // 8]
+        bit = x & 7
+        rows.append([(b >> bit) & 1 for b in column])
+    return rows
+
+
+def WritePNG(path: str, vram: bytes) -> None:
+    """Saves a single frame as a 1-bit grayscale PNG"""
+    raw = bytearray()
+    for row in ToRows(vram):
+        raw.append(0) # No filter
+        for i in range(0, HEIGHT, 8):
+            byte = 0
+            for pixel in row[i: i + 8]:
+                byte = (byte << 1) | pixel
+            raw.append(byte)
+
+    def Chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(Chunk(b"IHDR", struct.pack(">IIBBBBB", HEIGHT, WIDTH, 1, 0, 0, 0, 0)))
+        f.write(Chunk(b"IDAT", zlib.compress(bytes(raw))))
+        f.write(Chunk(b"IEND", b""))
+
+
+def WriteY4M(path: str, frames) -> None:
+    """Saves a sequence of frames as a monochrome YUV4MPEG2 video"""
+    with open(path, "wb") as f:
+        f.write(f"YUV4MPEG2 W{HEIGHT} H{WIDTH} F60:1 Ip A1:1 Cmono\n".encode())
+        for vram in frames:
+            f.write(b"FRAME\n")
+            f.write(bytes(pixel * 255 for row in ToRows(vram) for pixel in row))
+
+
+if __name__ == "__main__":
+    argp = ArgumentParser("python framestream.py")
+    argp.add_argument("stream", type=str, help="Path to a stream recorded with --record")
+    argp.add_argument("--y4m", type=str, help="Write the whole recording into this video file")
+    argp.add_argument("--png", type=str, help="Write every frame as a PNG into this directory")
+    args = argp.parse_args()
+
+    if(args.y4m):
+        WriteY4M(args.y4m, ReadFrames(args.stream))
+    if(args.png):
+        os.makedirs(args.png, exist_ok=True)
+        for i, vram in enumerate(ReadFrames(args.stream)):
+            WritePNG(os.path.join(args.png, f"{i:06}.png"), vram)
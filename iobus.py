@@ -0,0 +1,74 @@
+class IOBus:
+    """Port-mapped I/O for the 8080, devices register their handlers into 256-entry read and write tables"""
+    def __init__(self) -> None:
+        # Unmapped ports are left as None, the CPU ignores them
+        self.read_table = [None] * 256
+        self.write_table = [None] * 256
+
+    def MapRead(self, port: int, handler) -> None:
+        """Makes IN on the port return the value of handler()"""
+        if(self.read_table[port] is not None):
+            raise ValueError(f"Port {port} already has a reader")
+        self.read_table[port] = handler
+
+    def MapWrite(self, port: int, handler) -> None:
+        """Makes OUT on the port call handler(value)"""
+        if(self.write_table[port] is not None):
+            raise ValueError(f"Port {port} already has a writer")
+        self.write_table[port] = handler
+
+
+class InputPorts:
+    """The cabinet's controls and dipswitches, read through ports 1 and 2"""
+    def __init__(self) -> None:
+        self.input1 = 0
+        self.input2 = 0
+
+    def Attach(self, bus: IOBus) -> None:
+        bus.MapRead(1, self.Read1)
+        bus.MapRead(2, self.Read2)
+
+    def Read1(self) -> int:
+        return self.input1
+
+    def Read2(self) -> int:
+        return self.input2
+
+
+class ShiftRegister:
+    """The dedicated 16-bit shift register, written through ports 2 and 4 and read through port 3"""
+    def __init__(self) -> None:
+        self.value = 0
+        self.offset = 0
+
+    def Attach(self, bus: IOBus) -> None:
+        bus.MapWrite(2, self.WriteOffset)
+        bus.MapWrite(4, self.WriteData)
+        bus.MapRead(3, self.Read)
+
+    def WriteOffset(self, val: int) -> None:
+        self.offset = val & 0x7
+
+    def WriteData(self, val: int) -> None:
+        self.value = (val << 8) | (self.value >> 8)
+
+    def Read(self) -> int:
+        return (self.value >> (8 - self.offset)) & 0xff
+
+    def SaveState(self) -> tuple:
+        return (self.value, self.offset)
+
+    def LoadState(self, state: tuple) -> None:
+        self.value, self.offset = state
+
+
+class Watchdog:
+    """The watchdog on port 6, the game writes to it regularly to keep the cabinet from resetting"""
+    def __init__(self) -> None:
+        self.kicks = 0
+
+    def Attach(self, bus: IOBus) -> None:
+        bus.MapWrite(6, self.Write)
+
+    def Write(self, val: int) -> None:
+        self.kicks += 1
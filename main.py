@@ -1,13 +1,45 @@
 from argparse import ArgumentParser 
 
 from emulator import Emulator
+from framestream import FrameRecorder
+from netplay import Netplay
+from spectator import SpectatorServer
 
 
 if __name__ == "__main__":
     argp = ArgumentParser("python main.py")
     argp.add_argument("rompath", type=str, help="Path to the ROM file")
     argp.add_argument("--debug", action="store_true")
+    argp.add_argument("--record", type=str, help="Record every frame into this stream file")
+    argp.add_argument("--headless", action="store_true", help="Run without a window, as fast as possible")
+    argp.add_argument("--frames", type=int, help="Stop after this many frames")
+    argp.add_argument("--serve", type=int, metavar="PORT", help="Broadcast the game to spectators on this TCP port")
+    argp.add_argument("--host", type=str, default="127.0.0.1", help="Address the spectator server listens on")
+    argp.add_argument("--netplay", type=int, metavar="PORT", help="Play against another emulator, listening on this UDP port")
+    argp.add_argument("--peer", type=str, metavar="HOST:PORT", help="Address of the other emulator")
+    argp.add_argument("--player", type=int, choices=(1, 2), default=1, help="Which player this side controls")
+    argp.add_argument("--input-delay", type=int, default=2, help="Frames of input delay, more means fewer rollbacks")
+    argp.add_argument("--max-rollback", type=int,
+                      help="Most frames a rollback may re-run, by default it follows what fits into a frame on this machine")
+    argp.add_argument("--latency", type=int, default=0, help="Artificial network latency in milliseconds, for testing")
+    argp.add_argument("--metrics-file", type=str, help="Periodically write metrics into this file in the Prometheus text format")
+    argp.add_argument("--metrics-port", type=int, help="Serve metrics over HTTP on this local port")
+    argp.add_argument("--metrics-interval", type=float, default=5.0, help="Seconds between metrics file updates")
+    argp.add_argument("--overlay", action="store_true", help="Start with the performance overlay shown")
     args = argp.parse_args()
+    if(args.netplay):
+        peer_host, _, peer_port = (args.peer or "").rpartition(":")
+        if(not peer_host or not peer_port.isdigit()):
+            argp.error("--netplay needs --peer HOST:PORT")
     
-    emu = Emulator(args.rompath, args.debug)
-    emu.Run()
+    sinks = []
+    if(args.record):
+        sinks.append(FrameRecorder(args.record))
+    if(args.serve):
+        sinks.append(SpectatorServer(args.host, args.serve))
+    emu = Emulator(args.rompath, args.debug, args.headless, tuple(sinks), args.metrics_file, args.metrics_port,
+                   args.metrics_interval, args.overlay)
+    if(args.netplay):
+        emu.netplay = Netplay(emu, args.player, args.netplay, (peer_host, int(peer_port)), args.input_delay,
+                              args.max_rollback, args.latency / 1000)
+    emu.Run(args.frames)
@@ -0,0 +1,180 @@
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PHASES = ("events", "cpu", "render", "flip")
+
+
+class Metrics:
+    """Collects emulation health figures once per frame and exports them in the Prometheus text format"""
+    def __init__(self, clockspeed: int, refresh_rate: int, path: str | None = None, port: int | None = None,
+                 interval: float = 5.0) -> None:
+        self.clockspeed = clockspeed
+        self.frame_budget = 1 / refresh_rate
+
+        # Counters, they only ever grow
+        self.frames = 0
+        self.late_frames = 0
+        self.cycles = 0
+        self.instructions = 0
+        self.interrupts = 0
+        self.missed_interrupts = 0
+        self.resim_frames = 0
+        self.resim_cycles = 0
+        self.rollbacks = 0
+        self.resim_seconds = 0.0
+        self.resim_over_budget = 0
+        self.stalls = 0
+        self.phase_seconds = dict.fromkeys(PHASES, 0.0)
+
+        # Gauges, recalculated about once a second
+        self.mhz = 0.0
+        self.fps = 0.0
+        self.instructions_per_frame = 0.0
+        self.last_phases = dict.fromkeys(PHASES, 0.0)
+        self.resim_seconds_max = 0.0
+        self.rollback_window = None # Only netplay sets it
+        self.window_start = time.perf_counter()
+        self.window_frames = self.window_cycles = self.window_instructions = 0
+
+        self.path = path
+        self.interval = interval
+        self.write_error = None
+        self.last_write = self.window_start
+
+        self.server = None
+        if(port is not None):
+            metrics = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self) -> None:
+                    body = metrics.Render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args) -> None:
+                    pass
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+            threading.Thread(target=self.server.serve_forever, name="Metrics", daemon=True).start()
+
+    def CountFrame(self, cycles: int, instructions: int, interrupts: int, missed_interrupts: int,
+                   resimulated: bool = False) -> None:
+        """Called by every emulated frame, the ones that netplay runs again are counted apart"""
+        if(resimulated):
+            # They would push the speed figures up exactly when the game falls behind
+            self.resim_frames += 1
+            self.resim_cycles += cycles
+            return
+        self.cycles += cycles
+        self.instructions += instructions
+        self.interrupts += interrupts
+        self.missed_interrupts += missed_interrupts
+        self.window_cycles += cycles
+        self.window_instructions += instructions
+        self.window_frames += 1
+
+    def CountRollback(self, seconds: float, over_budget: bool) -> None:
+        """Called by netplay after every rollback with the time its frames took to run again"""
+        self.rollbacks += 1
+        self.resim_seconds += seconds
+        self.resim_seconds_max = max(self.resim_seconds_max, seconds)
+        self.resim_over_budget += over_budget
+
+    def CountStall(self) -> None:
+        """Called by netplay when it waits for the remote inputs instead of running a frame"""
+        self.stalls += 1
+
+    def EndFrame(self, phases: dict) -> None:
+        """Called once per iteration of the main loop with the seconds spent in each phase"""
+        self.frames += 1
+        for phase, seconds in phases.items():
+            self.phase_seconds[phase] += seconds
+        self.last_phases = phases
+        if(sum(phases.values()) > self.frame_budget):
+            self.late_frames += 1
+
+        now = time.perf_counter()
+        elapsed = now - self.window_start
+        if(elapsed >= 1.0):
+            self.mhz = self.window_cycles / elapsed / 1e6
+            self.fps = self.window_frames / elapsed
+            self.instructions_per_frame = self.window_instructions / max(self.window_frames, 1)
+            self.window_start = now
+            self.window_frames = self.window_cycles = self.window_instructions = 0
+
+        if(self.path is not None and now - self.last_write >= self.interval):
+            self.last_write = now
+            self.Write()
+
+    def OverlayLines(self) -> list:
+        lines = [f"{self.mhz:.2f} MHz ({self.mhz * 1e6 / self.clockspeed:.0%}) {self.fps:.1f} fps",
+                 f"{self.instructions_per_frame:.0f} instructions/frame",
+                 " ".join(f"{phase} {seconds * 1000:.1f}ms" for phase, seconds in self.last_phases.items()),
+                 f"late {self.late_frames} missed irq {self.missed_interrupts}"]
+        if(self.rollback_window is not None):
+            lines.append(f"rollbacks {self.rollbacks} ({self.resim_frames} frames, worst {self.resim_seconds_max * 1000:.1f}ms, "
+                         f"over {self.resim_over_budget}) window {self.rollback_window} stalls {self.stalls}")
+        return lines
+
+    def Render(self) -> str:
+        """Formats every metric in the Prometheus text exposition format"""
+        lines = []
+
+        def Add(name: str, kind: str, help: str, samples: list) -> None:
+            lines.append(f"# HELP spaceinvaders_{name} {help}")
+            lines.append(f"# TYPE spaceinvaders_{name} {kind}")
+            for labels, value in samples:
+                lines.append(f"spaceinvaders_{name}{labels} {value}")
+
+        Add("frames_total", "counter", "Iterations of the main loop", [("", self.frames)])
+        Add("late_frames_total", "counter", "Frames whose work took longer than the refresh interval", [("", self.late_frames)])
+        Add("cycles_total", "counter", "Emulated CPU cycles", [("", self.cycles)])
+        Add("instructions_total", "counter", "Emulated CPU instructions", [("", self.instructions)])
+        Add("interrupts_total", "counter", "Interrupts delivered to the CPU", [("", self.interrupts)])
+        Add("missed_interrupts_total", "counter", "Frames ended with a video interrupt undelivered", [("", self.missed_interrupts)])
+        Add("resim_frames_total", "counter", "Frames run again by netplay rollbacks", [("", self.resim_frames)])
+        Add("resim_cycles_total", "counter", "CPU cycles run again by netplay rollbacks", [("", self.resim_cycles)])
+        Add("rollbacks_total", "counter", "Netplay rollbacks", [("", self.rollbacks)])
+        Add("resim_seconds_total", "counter", "Time spent running frames again in netplay rollbacks", [("", self.resim_seconds)])
+        Add("resim_over_budget_total", "counter", "Netplay rollbacks that didn't fit into a frame next to the new frame",
+            [("", self.resim_over_budget)])
+        Add("netplay_stalls_total", "counter", "Frames netplay spent waiting for the remote inputs", [("", self.stalls)])
+        Add("phase_seconds_total", "counter", "Time spent in each phase of the main loop",
+            [(f'{{phase="{phase}"}}', seconds) for phase, seconds in self.phase_seconds.items()])
+        Add("emulated_mhz", "gauge", "Emulated clock speed over the last second", [("", self.mhz)])
+        Add("realtime_ratio", "gauge", "Emulated clock speed relative to the real hardware", [("", self.mhz * 1e6 / self.clockspeed)])
+        Add("fps", "gauge", "Emulated frames per second over the last second", [("", self.fps)])
+        Add("instructions_per_frame", "gauge", "Average instructions per emulated frame over the last second",
+            [("", self.instructions_per_frame)])
+        Add("resim_seconds_max", "gauge", "Longest netplay rollback so far", [("", self.resim_seconds_max)])
+        if(self.rollback_window is not None):
+            Add("rollback_window", "gauge", "Most frames a netplay rollback may currently run again", [("", self.rollback_window)])
+        return "\n".join(lines) + "\n"
+
+    def Write(self) -> None:
+        """Writes the metrics file, a failure is reported once and doesn't stop the emulation"""
+        # Written next to the target and renamed, so a scraper never reads a half written file
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w") as f:
+                f.write(self.Render())
+            os.replace(temp_path, self.path)
+        except OSError as error:
+            if(str(error) != self.write_error): # Every interval would repeat it otherwise
+                print(f"Can't write metrics: {error}", file=sys.stderr)
+            self.write_error = str(error)
+        else:
+            self.write_error = None
+
+    def Close(self) -> None:
+        if(self.path is not None):
+            self.Write()
+        if(self.server is not None):
+            self.server.shutdown()
+            self.server.server_close()
@@ -0,0 +1,192 @@
+import socket
+import struct
+import time
+
+# The inputs of a frame are packed into one word, input1 in the low byte and input2 in the high byte.
+# Player 2 owns its start button and its controls on port 2, player 1 owns the rest, including the coin slot and dipswitches.
+PLAYER_MASKS = {1: 0xffff ^ 0x7002, 2: 0x7002}
+
+PACKET = struct.Struct("<iIH") # last frame the sender has every remote input for, first frame, number of inputs that follow
+INPUT = struct.Struct("<H")
+
+SAFETY = 0.75 # Share of a frame that the emulation plans to fill, the rest is left for jitter
+DECAY = 0.99  # The measured costs follow the slowest recent frame, and forget it over a few seconds
+
+
+class Netplay:
+    """Two player netplay over UDP, the remote player's inputs are predicted and mispredicted frames are rolled back"""
+    def __init__(self, emu, player: int, local_port: int, peer: tuple, input_delay: int = 2,
+                 max_rollback: int | None = None, latency: float = 0.0) -> None:
+        self.emu = emu
+        self.local_mask = PLAYER_MASKS[player]
+        self.remote_mask = PLAYER_MASKS[3 - player]
+        self.input_delay = input_delay
+        self.frame_budget = emu.metrics.frame_budget
+        # A rollback re-runs up to max_rollback frames. By default only as many as fit into a frame next to
+        # running and drawing the new one, the window keeps following the measured costs while playing.
+        self.adaptive = max_rollback is None
+        self.frame_cost = 0.0 # Seconds to run one frame
+        self.overhead = 0.0   # Seconds the main loop spends on everything but the emulation
+        if(self.adaptive):
+            self.MeasureCosts()
+        self.max_rollback = self.RollbackWindow() if self.adaptive else max_rollback
+        self.latency = latency # Artificial one-way delay in seconds, for testing on loopback
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("", local_port))
+        self.sock.setblocking(False)
+        # Resolved up front, received packets are matched against it
+        self.peer = (socket.gethostbyname(peer[0]), peer[1])
+        self.outgoing = [] # (send time, packet) pairs held back by the artificial latency
+
+        # The first frames have no inputs from either side, the input delay pushes everyone's first input past them
+        self.frame = 0
+        self.local_inputs = {frame: 0 for frame in range(input_delay)}
+        self.remote_inputs = {frame: 0 for frame in range(input_delay)}
+        self.confirmed = input_delay - 1 # Every remote input up to this frame has arrived
+        self.peer_confirmed = input_delay - 1 # The same from the peer's side, as acknowledged in its packets
+        self.predicted = {}
+        self.states = {}
+        self.pruned = self.pruned_local = 0
+
+    def MeasureCosts(self) -> None:
+        """Times a few frames and the drawing, for the first guess of the rollback window"""
+        state = self.emu.SaveState()
+        audio_enabled = self.emu.audio.audio_enabled
+        self.emu.audio.audio_enabled = False
+        for _ in range(10):
+            begin = time.perf_counter()
+            self.emu.RunFrame(counted=False) # Thrown away, no rollback happened
+            self.frame_cost = max(self.frame_cost, time.perf_counter() - begin)
+        if(not self.emu.headless):
+            begin = time.perf_counter()
+            self.emu.DrawFrame()
+            self.overhead = time.perf_counter() - begin
+        self.emu.audio.audio_enabled = audio_enabled
+        self.emu.LoadState(state)
+
+    def RollbackWindow(self) -> int:
+        """How many frames a rollback can re-run within a frame that also runs and draws a new frame, 0 means lockstep"""
+        spare = SAFETY * self.frame_budget - self.overhead - self.frame_cost
+        return max(0, int(spare / self.frame_cost))
+
+    def Advance(self) -> None:
+        """Runs at most one new frame, rolling back first if the remote inputs turned out to be mispredicted"""
+        live = self.emu.inputs.input1 | (self.emu.inputs.input2 << 8)
+        # While stalled the frame doesn't move, and the input that was already sent must not change
+        self.local_inputs.setdefault(self.frame + self.input_delay, live & self.local_mask)
+        self.Send()
+        rollback_to = self.Receive()
+
+        if(rollback_to is not None):
+            self.Resimulate(rollback_to)
+
+        if(self.adaptive):
+            # The phases of the previous iteration, the emulation itself is timed in RunFrame
+            phases = self.emu.metrics.last_phases
+            self.overhead = max(phases["events"] + phases["render"] + phases["flip"], self.overhead * DECAY)
+            self.max_rollback = self.RollbackWindow()
+        self.emu.metrics.rollback_window = self.max_rollback
+
+        # Don't run so far ahead that a late input would need more rollback than allowed
+        if(self.frame - self.confirmed <= self.max_rollback):
+            self.RunFrame(self.frame)
+            self.frame += 1
+        else:
+            self.emu.metrics.CountStall()
+        self.Prune()
+
+        # The keyboard keeps working on the live inputs, not on the ones that the frames were run with
+        self.emu.inputs.input1 = live & 0xff
+        self.emu.inputs.input2 = live >> 8
+
+    def RunFrame(self, frame: int, resimulated: bool = False) -> None:
+        """Saves the state before the frame so it can be rolled back, then runs it with both players' inputs"""
+        begin = time.perf_counter()
+        self.states[frame] = self.emu.SaveState()
+        remote = self.remote_inputs.get(frame)
+        if(remote is None):
+            # Predict that the remote player keeps doing the same thing
+            remote = self.remote_inputs.get(self.confirmed, 0)
+            self.predicted[frame] = remote
+        word = self.local_inputs[frame] | remote
+        self.emu.inputs.input1 = word & 0xff
+        self.emu.inputs.input2 = word >> 8
+        self.emu.RunFrame(resimulated)
+        self.frame_cost = max(time.perf_counter() - begin, self.frame_cost * DECAY)
+
+    def Resimulate(self, start: int) -> None:
+        """Restores the state from before the first mispredicted frame and runs every frame again up to the present"""
+        begin = time.perf_counter()
+        self.emu.LoadState(self.states[start])
+
+        # The sounds were already played the first time around
+        audio_enabled = self.emu.audio.audio_enabled
+        self.emu.audio.audio_enabled = False
+        for frame in range(start, self.frame):
+            self.predicted.pop(frame, None)
+            self.RunFrame(frame, resimulated=True)
+        self.emu.audio.audio_enabled = audio_enabled
+
+        # Over budget when there was no room left in the frame for the new frame
+        elapsed = time.perf_counter() - begin
+        self.emu.metrics.CountRollback(elapsed, elapsed + self.frame_cost + self.overhead > self.frame_budget)
+
+    def Send(self) -> None:
+        # Every packet repeats all the inputs the peer hasn't acknowledged yet, so even a burst of lost packets is recovered from
+        newest = self.frame + self.input_delay
+        first = self.peer_confirmed + 1
+        inputs = [INPUT.pack(self.local_inputs[frame]) for frame in range(first, newest + 1)]
+        packet = PACKET.pack(self.confirmed, first, len(inputs)) + b"".join(inputs)
+        self.outgoing.append((time.perf_counter() + self.latency, packet))
+
+        now = time.perf_counter()
+        while(self.outgoing and self.outgoing[0][0] <= now):
+            try:
+                self.sock.sendto(self.outgoing.pop(0)[1], self.peer)
+            except OSError: # The peer isn't listening yet
+                pass
+
+    def Receive(self) -> int | None:
+        """Stores the remote inputs that arrived, returns the first frame that has to be rolled back"""
+        rollback_to = None
+        while(True):
+            try:
+                packet, address = self.sock.recvfrom(4096)
+            except (BlockingIOError, ConnectionError):
+                break
+
+            # Anything that isn't a well-formed packet from the peer is ignored
+            if(address != self.peer or len(packet) < PACKET.size):
+                continue
+            ack, first, count = PACKET.unpack_from(packet)
+            if(len(packet) != PACKET.size + count * INPUT.size):
+                continue
+            self.peer_confirmed = max(self.peer_confirmed, ack)
+            for i in range(count):
+                frame = first + i
+                if(frame <= self.confirmed or frame in self.remote_inputs):
+                    continue
+                remote = INPUT.unpack_from(packet, PACKET.size + i * INPUT.size)[0] & self.remote_mask
+                self.remote_inputs[frame] = remote
+                if(frame in self.predicted and self.predicted.pop(frame) != remote):
+                    rollback_to = frame if rollback_to is None else min(rollback_to, frame)
+
+        while(self.confirmed + 1 in self.remote_inputs):
+            self.confirmed += 1
+        return rollback_to
+
+    def Prune(self) -> None:
+        """Forgets what can't be needed anymore, a rollback can only go back to the first unconfirmed frame"""
+        # The remote inputs can be confirmed ahead of the frames that ran, those are still needed to run them
+        while(self.pruned < min(self.confirmed, self.frame)):
+            self.states.pop(self.pruned, None)
+            self.remote_inputs.pop(self.pruned, None)
+            self.pruned += 1
+        # Local inputs are kept until the peer acknowledged them, and as long as a rollback could still use them
+        while(self.pruned_local <= min(self.confirmed - 1, self.frame - 1, self.peer_confirmed)):
+            self.local_inputs.pop(self.pruned_local, None)
+            self.pruned_local += 1
+
+    def Close(self) -> None:
+        self.sock.close()
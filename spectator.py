@@ -0,0 +1,130 @@
+import asyncio
+import socket
+import threading
+from argparse import ArgumentParser
+
+from framestream import (HEADER, MAGIC, RECORD, VERSION, VRAM_END, VRAM_START, WIDTH, HEIGHT, DecodeRecord, EncodeDelta,
+                         EncodeKeyframe)
+
+
+class Spectator:
+    """A connected viewer, its queue holds the packets that haven't been sent to it yet"""
+    def __init__(self, writer: asyncio.StreamWriter, queue_size: int) -> None:
+        self.writer = writer
+        self.task = asyncio.current_task()
+        self.queue = asyncio.Queue(queue_size)
+        self.needs_keyframe = True
+
+
+class SpectatorServer:
+    """Broadcasts every frame to TCP viewers, the asyncio loop runs on its own thread so the emulator never waits on it"""
+    realtime = True
+
+    def __init__(self, host: str, port: int, queue_size: int = 8) -> None:
+        self.queue_size = queue_size
+        self.spectators = set()
+        self.prev = None
+
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(asyncio.start_server(self.HandleSpectator, host, port))
+        self.thread = threading.Thread(target=self.loop.run_forever, name="SpectatorServer", daemon=True)
+        self.thread.start()
+
+    def Submit(self, mem: bytearray) -> None:
+        """Hands the current frame over to the server's thread"""
+        self.loop.call_soon_threadsafe(self.Broadcast, mem[VRAM_START: VRAM_END])
+
+    def Close(self) -> None:
+        """Disconnects every viewer and stops the server's thread"""
+        asyncio.run_coroutine_threadsafe(self.Shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def Shutdown(self) -> None:
+        self.server.close()
+        tasks = []
+        for spectator in self.spectators:
+            while(not spectator.queue.empty()):
+                spectator.queue.get_nowait()
+            spectator.queue.put_nowait(None)
+            spectator.writer.close() # Unblocks a handler stuck waiting on a viewer that stopped reading
+            tasks.append(spectator.task)
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def Broadcast(self, vram: bytearray) -> None:
+        """Encodes the frame once and queues it for every viewer"""
+        # Both packets are only built when someone needs them, and then shared by everyone
+        delta = keyframe = None
+        for spectator in self.spectators:
+            if(spectator.queue.full()):
+                # The viewer fell behind, the queued deltas are useless now, so restart it from a keyframe
+                while(not spectator.queue.empty()):
+                    spectator.queue.get_nowait()
+                spectator.needs_keyframe = True
+
+            if(spectator.needs_keyframe or self.prev is None):
+                if(keyframe is None):
+                    keyframe = EncodeKeyframe(vram)
+                spectator.queue.put_nowait(keyframe)
+                spectator.needs_keyframe = False
+            else:
+                if(delta is None):
+                    delta = EncodeDelta(self.prev, vram)
+                spectator.queue.put_nowait(delta)
+        self.prev = vram
+
+    async def HandleSpectator(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        spectator = Spectator(writer, self.queue_size)
+        self.spectators.add(spectator)
+        try:
+            writer.write(HEADER.pack(MAGIC, VERSION, WIDTH, HEIGHT))
+            while((packet := await spectator.queue.get()) is not None):
+                writer.write(packet)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.spectators.discard(spectator)
+            writer.close()
+
+
+def ReceiveExactly(sock: socket.socket, size: int) -> bytes:
+    data = bytearray()
+    while(len(data) < size):
+        chunk = sock.recv(size - len(data))
+        if(not chunk):
+            raise ConnectionError("The server closed the connection")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def Watch(host: str, port: int) -> None:
+    """A reference viewer that renders the broadcast in a window"""
+    import pygame
+
+    from emulator import DrawVRAM
+
+    pygame.init()
+    pygame.display.set_caption("Space Invaders - Spectating")
+    scaled = pygame.display.set_mode((672, 768))
+
+    with socket.create_connection((host, port)) as sock:
+        magic, version, width, height = HEADER.unpack(ReceiveExactly(sock, HEADER.size))
+        if(magic != MAGIC or version != VERSION or (width, height) != (WIDTH, HEIGHT)):
+            raise ValueError("The server is not sending a supported frame stream")
+
+        vram = None
+        while(not any(event.type == pygame.QUIT for event in pygame.event.get())):
+            kind, length = RECORD.unpack(ReceiveExactly(sock, RECORD.size))
+            vram = DecodeRecord(kind, ReceiveExactly(sock, length), vram)
+            DrawVRAM(vram, scaled)
+            pygame.display.flip()
+
+
+if __name__ == "__main__":
+    argp = ArgumentParser("python spectator.py")
+    argp.add_argument("host", type=str, help="Address of the emulator started with --serve")
+    argp.add_argument("port", type=int)
+    args = argp.parse_args()
+
+    Watch(args.host, args.port)
@@ -0,0 +1,109 @@
+import hashlib
+import random
+import time
+import unittest
+from types import SimpleNamespace
+
+from iobus import InputPorts
+from metrics import Metrics
+from netplay import Netplay
+
+FRAMES = 150
+
+
+class Machine:
+    """Stands in for the emulator without pygame or a ROM, every frame mixes the inputs into the memory"""
+    def __init__(self) -> None:
+        self.mem = bytearray(64)
+        self.inputs = InputPorts()
+        self.audio = SimpleNamespace(audio_enabled=False)
+        self.metrics = Metrics(2000000, 60)
+        self.headless = True
+
+    def RunFrame(self, resimulated: bool = False, counted: bool = True) -> None:
+        word = self.inputs.input1 | (self.inputs.input2 << 8)
+        self.mem[:32] = hashlib.sha256(bytes(self.mem) + word.to_bytes(2, "little")).digest()
+        if(counted):
+            self.metrics.CountFrame(0, 0, 0, 0, resimulated)
+
+    def SaveState(self) -> bytes:
+        return bytes(self.mem)
+
+    def LoadState(self, state: bytes) -> None:
+        self.mem[:] = state
+
+
+class LossySocket:
+    """Drops a share of the sent packets"""
+    def __init__(self, sock, loss: float, rng: random.Random) -> None:
+        self.sock = sock
+        self.loss = loss
+        self.rng = rng
+
+    def sendto(self, packet: bytes, address: tuple) -> None:
+        if(self.rng.random() >= self.loss):
+            self.sock.sendto(packet, address)
+
+    def __getattr__(self, name: str):
+        return getattr(self.sock, name)
+
+
+class NetplayTest(unittest.TestCase):
+    def Play(self, max_rollback: int | None, loss: float, latency: float = 0.02, seed: int = 1) -> list:
+        """Runs two sides over loopback and returns them with the memory hash after every frame they ran last"""
+        rng = random.Random(seed)
+        sides = [Netplay(Machine(), player, 0, ("127.0.0.1", 0), 2, max_rollback, latency) for player in (1, 2)]
+        for side, other in zip(sides, reversed(sides)):
+            side.peer = ("127.0.0.1", other.sock.getsockname()[1])
+            side.sock = LossySocket(side.sock, loss, rng)
+
+            # A rollback runs frames again, the hash kept is the one from the last run
+            side.hashes = {}
+
+            def RunFrame(frame: int, resimulated: bool = False, side=side, run=side.RunFrame) -> None:
+                run(frame, resimulated)
+                side.hashes[frame] = hashlib.sha256(side.emu.mem).digest()
+            side.RunFrame = RunFrame
+
+        deadline = time.perf_counter() + 30
+        try:
+            while(min(side.frame for side in sides) < FRAMES):
+                self.assertLess(time.perf_counter(), deadline, "Netplay stopped making progress")
+                for side in sides:
+                    if(rng.random() < 0.2): # Pressing and releasing keys all the time, so predictions miss
+                        side.emu.inputs.input1 = rng.randrange(256)
+                        side.emu.inputs.input2 = rng.randrange(256)
+                    side.Advance()
+                time.sleep(0.001)
+        finally:
+            for side in sides:
+                side.Close()
+        return sides
+
+    def AssertInSync(self, sides: list) -> None:
+        last = min(min(side.confirmed, side.frame - 1) for side in sides)
+        self.assertGreater(last, FRAMES // 2)
+        for frame in range(last + 1):
+            self.assertEqual(sides[0].hashes[frame], sides[1].hashes[frame], f"The sides diverged at frame {frame}")
+
+    def test_lossy_rollback(self) -> None:
+        for max_rollback in (1, 2, 8):
+            with self.subTest(max_rollback=max_rollback):
+                sides = self.Play(max_rollback, 0.25)
+                self.AssertInSync(sides)
+                self.assertGreater(sum(side.emu.metrics.rollbacks for side in sides), 0)
+
+    def test_lossy_lockstep(self) -> None:
+        sides = self.Play(0, 0.25)
+        self.AssertInSync(sides)
+        self.assertEqual(sum(side.emu.metrics.rollbacks for side in sides), 0)
+
+    def test_measured_window(self) -> None:
+        sides = self.Play(None, 0.2)
+        self.AssertInSync(sides)
+        for side in sides:
+            self.assertEqual(side.emu.metrics.rollback_window, side.max_rollback)
+
+
+if __name__ == "__main__":
+    unittest.main()